@@ -2,7 +2,10 @@
 3D mesh format conversion. GLB-first: all files are stored as GLB.
 """
 
+import json
+import struct
 from pathlib import Path
+from typing import Optional, Tuple
 import trimesh
 
 
@@ -173,3 +176,45 @@ def _mesh_has_textures(mesh) -> bool:
                 return True
 
     return False
+
+
+def glb_counts(glb_path: Path) -> Optional[Tuple[int, int]]:
+    """
+    Return (vertices, faces) of a GLB from its JSON chunk only, without decoding any buffer.
+
+    Counts come from accessors, one per node instance like a flattened scene. Vertices are
+    not merged across UV/normal seams (trimesh.load would). Returns None if not a readable GLB.
+    """
+    try:
+        with open(glb_path, 'rb') as f:
+            header = f.read(20)
+            if len(header) < 20:
+                return None
+            magic, _, _, chunk_length, chunk_type = struct.unpack('<4sIIII', header)
+            if magic != b'glTF' or chunk_type != 0x4E4F534A:  # 'JSON'
+                return None
+            gltf = json.loads(f.read(chunk_length))
+
+        accessors = gltf.get('accessors', [])
+        mesh_counts = []
+        for mesh in gltf.get('meshes', []):
+            vertices = faces = 0
+            for primitive in mesh.get('primitives', []):
+                position = primitive.get('attributes', {}).get('POSITION')
+                if primitive.get('mode', 4) != 4 or position is None:  # triangles only
+                    continue
+                count = accessors[position]['count']
+                vertices += count
+                indices = primitive.get('indices')
+                faces += (accessors[indices]['count'] if indices is not None else count) // 3
+            mesh_counts.append((vertices, faces))
+
+        instances = [node['mesh'] for node in gltf.get('nodes', []) if 'mesh' in node]
+        if not instances:
+            instances = range(len(mesh_counts))
+        return (
+            sum(mesh_counts[i][0] for i in instances),
+            sum(mesh_counts[i][1] for i in instances)
+        )
+    except (OSError, ValueError, KeyError, IndexError, struct.error):
+        return None
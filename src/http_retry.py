@@ -0,0 +1,30 @@
+"""
+Retry policy for remote generation APIs (Stability, RunPod).
+
+Only failures where the request was not processed are retried: rate limiting / temporary
+unavailability statuses, and errors raised before the request reached the server.
+"""
+
+import random
+from typing import Optional
+
+# A 502/504 may come back after the upstream already accepted (and billed) the request, so only
+# statuses that guarantee the request was rejected are retried
+RETRY_STATUSES = {429, 503}
+MAX_ATTEMPTS = 5
+MAX_DELAY = 30.0
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Seconds to wait before retry number attempt + 1.
+
+    Honors a numeric Retry-After header, otherwise exponential backoff (1s, 2s, 4s, ...)
+    with jitter, capped at MAX_DELAY.
+    """
+    if retry_after:
+        try:
+            return min(MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # HTTP-date form: fall back to backoff
+    return min(MAX_DELAY, 2.0 ** attempt) * random.uniform(0.5, 1.0)
@@ -8,7 +8,7 @@ import shutil
 import time
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional, Union
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
@@ -23,20 +23,27 @@ logger = logging.getLogger(__name__)
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, NonNegativeFloat
 import trimesh
 
 from .task_manager import task_manager, Task
-from .simplify import simplify_mesh_glb
-from .converter import convert_mesh_format, convert_any_to_glb
+from .simplify import simplify_mesh_glb, simplify_meshes_glb
+from .converter import convert_mesh_format, convert_any_to_glb, glb_counts
 from .mamouth_client import generate_image_from_prompt, generate_texture_from_prompt, infer_physics_from_prompt
 from .retopology import retopologize_mesh, retopologize_mesh_glb
 from .segmentation import segment_mesh, segment_mesh_glb
 from .temp_utils import cleanup_temp_directory, safe_delete
+from . import mesh_cache
 
 load_dotenv()
 
 
+async def _close_trellis_client():
+    """Close TRELLIS's shared HTTP client on the task manager loop that owns it."""
+    from .trellis_client import aclose_client
+    await aclose_client()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan: startup and shutdown logic."""
@@ -68,10 +75,12 @@ async def lifespan(app: FastAPI):
     task_manager.register_handler("unwrap_uv", unwrap_uv_task_handler)
     task_manager.register_handler("bake_texture", bake_texture_task_handler)
     task_manager.register_handler("generate_lod", generate_lod_task_handler)
+    task_manager.register_loop_cleanup(_close_trellis_client)
     task_manager.start()
 
     logger.info("Cleaning up temp files...")
     cleanup_temp_directory(DATA_TEMP, max_age_hours=1)
+    mesh_cache.evict()
 
     logger.info("Backend started successfully")
 
@@ -166,6 +175,8 @@ class SimplifyRequest(BaseModel):
     reduction_ratio: Optional[float] = None
     is_generated: bool = False  # If True, looks in data/generated_meshes
     preserve_texture: bool = False  # If True, transfers UVs via KDTree after simplification
+    preserve_border: bool = True  # Keep open-border vertices fixed
+    max_error: Optional[Union[NonNegativeFloat, Literal["auto"]]] = None  # Stop early past this QEM error ("auto" = 1% of bbox diagonal)
 
 class GenerateMeshRequest(BaseModel):
     """Mesh generation parameters. Output format is always GLB."""
@@ -652,7 +663,9 @@ def simplify_task_handler(task: Task):
         target_triangles=params.get("target_triangles"),
         reduction_ratio=params.get("reduction_ratio", 0.5),
         preserve_texture=params.get("preserve_texture", False),
-        temp_dir=DATA_TEMP
+        temp_dir=DATA_TEMP,
+        preserve_border=params.get("preserve_border", True),
+        max_error=params.get("max_error")
     )
 
     if result.get('success'):
@@ -700,7 +713,9 @@ async def simplify_mesh_async(request: SimplifyRequest):
             "target_triangles": request.target_triangles,
             "reduction_ratio": request.reduction_ratio,
             "is_generated": request.is_generated,
-            "preserve_texture": request.preserve_texture
+            "preserve_texture": request.preserve_texture,
+            "preserve_border": request.preserve_border,
+            "max_error": request.max_error
         }
     )
 
@@ -950,6 +965,17 @@ async def list_session_images(session_id: str):
         "count": len(images)
     }
 
+def _finalize_generated_mesh(result: dict, provider: str, session_id: str, output_path: Path) -> dict:
+    """Add the common response fields to a provider result (mesh cleanup is done by the providers)."""
+    if result.get('success'):
+        logger.info(f"[GENERATE-MESH] Success: {output_path.name}")
+        result['output_filename'] = output_path.name
+        result['session_id'] = session_id
+        result['images_used'] = 1
+        result['provider'] = provider
+
+    return result
+
 def generate_mesh_task_handler(task: Task):
     """3D generation handler. Routes to the correct provider: unique3d, triposr, or stability."""
     params = task.params
@@ -1013,14 +1039,20 @@ def generate_mesh_task_handler(task: Task):
             api_key=api_key
         )
     elif provider == "trellis":
-        from .trellis_client import generate_mesh_from_image_trellis
+        from .trellis_client import generate_mesh_from_image_trellis_async
         extra = image_paths[1:] if len(image_paths) > 1 else None
-        result = generate_mesh_from_image_trellis(
-            image_path=first_image,
-            output_path=output_path,
-            resolution=resolution,
-            extra_images=extra,
-        )
+
+        async def run_trellis():
+            result = await generate_mesh_from_image_trellis_async(
+                image_path=first_image,
+                output_path=output_path,
+                resolution=resolution,
+                extra_images=extra,
+            )
+            return _finalize_generated_mesh(result, provider, session_id, output_path)
+
+        # TRELLIS mostly waits on RunPod: poll on the task manager's event loop, not a worker thread
+        return run_trellis()
     elif provider == "trellis2":
         from .trellis2_client import generate_mesh_from_image_trellis2
         result = generate_mesh_from_image_trellis2(
@@ -1037,39 +1069,7 @@ def generate_mesh_task_handler(task: Task):
             resolution=resolution
         )
 
-    if result.get('success'):
-        # Mesh cleanup for TripoSR (TRELLIS handles its own cleanup in trellis_client.py)
-        if provider == "triposr":
-            try:
-                import trimesh
-                mesh = trimesh.load(str(output_path), force='mesh')
-                before = len(mesh.faces)
-
-                # Floater removal: keep largest connected component
-                components = mesh.split()
-                if len(components) > 1:
-                    mesh = max(components, key=lambda m: len(m.faces))
-                    logger.info(f"[GENERATE-MESH] Removed {len(components)-1} floater(s)")
-
-                mesh.remove_degenerate_faces()
-                mesh.remove_duplicate_faces()
-                mesh.fix_normals()
-                after = len(mesh.faces)
-                mesh.export(str(output_path))
-                if before != after:
-                    logger.info(f"[GENERATE-MESH] Cleanup: {before} -> {after} faces")
-                    result['faces_count'] = after
-                    result['vertices_count'] = len(mesh.vertices)
-            except Exception as e:
-                logger.warning(f"[GENERATE-MESH] Cleanup skipped: {e}")
-
-        logger.info(f"[GENERATE-MESH] Success: {output_filename}")
-        result['output_filename'] = output_filename
-        result['session_id'] = session_id
-        result['images_used'] = 1
-        result['provider'] = provider
-
-    return result
+    return _finalize_generated_mesh(result, provider, session_id, output_path)
 
 def generate_image_task_handler(task: Task):
     """Generate an image from a text prompt via Mamouth.ai."""
@@ -1427,7 +1427,6 @@ def unwrap_uv_task_handler(task: Task):
 
 def bake_texture_task_handler(task: Task):
     """Embed an Imagen-generated texture PNG into a mesh GLB via UV coordinates."""
-    import copy
     from PIL import Image as PILImage
     import numpy as np
 
@@ -1464,8 +1463,8 @@ def bake_texture_task_handler(task: Task):
         img = PILImage.open(str(texture_path)).convert('RGB')
 
         baked_geometries = {}
-        for name, geom in scene.geometry.items():
-            mesh = copy.deepcopy(geom)
+        # The scene is loaded fresh for this task, so geometries are modified in place
+        for name, mesh in scene.geometry.items():
 
             # Ensure UVs exist
             if not (hasattr(mesh.visual, 'uv') and mesh.visual.uv is not None):
@@ -2148,18 +2147,22 @@ def generate_lod_task_handler(task: Task):
 
     preserve_texture = params.get("preserve_texture", False)
 
-    # LOD1, LOD2, LOD3
-    for i, ratio in enumerate([0.5, 0.25, 0.10], start=1):
-        lod_path = DATA_OUTPUT / f"{stem}_LOD{i}.glb"
-        result = simplify_mesh_glb(
-            input_path=input_path,
-            output_path=lod_path,
-            reduction_ratio=1.0 - ratio,  # ratio = faces kept; reduction = faces removed
-            preserve_texture=preserve_texture,
-            temp_dir=DATA_TEMP
-        )
+    # LOD1, LOD2, LOD3: independent simplifications, run in parallel processes for large meshes
+    jobs = [
+        {
+            "input_path": input_path,
+            "output_path": DATA_OUTPUT / f"{stem}_LOD{i}.glb",
+            "reduction_ratio": 1.0 - ratio,  # ratio = faces kept; reduction = faces removed
+            "preserve_texture": preserve_texture,
+            "temp_dir": DATA_TEMP
+        }
+        for i, ratio in enumerate([0.5, 0.25, 0.10], start=1)
+    ]
+    results = simplify_meshes_glb(jobs, source_faces=original_faces)
+
+    for i, (job, result) in enumerate(zip(jobs, results), start=1):
         faces = result.get("simplified_triangles", 0) if result.get("success") else 0
-        lods.append({"level": i, "filename": lod_path.name, "faces_count": faces})
+        lods.append({"level": i, "filename": job["output_path"].name, "faces_count": faces})
 
     # Pack all 4 LOD files into a ZIP
     zip_filename = f"{stem}_LODs.zip"
@@ -2179,14 +2182,15 @@ def generate_lod_task_handler(task: Task):
 
 
 def _count_faces_glb(path: Path) -> int:
+    counts = glb_counts(path)
+    if counts is not None:
+        return counts[1]
     try:
         loaded = trimesh.load(str(path))
         if hasattr(loaded, "geometry"):
-            meshes = list(loaded.geometry.values())
-            mesh = meshes[0] if len(meshes) == 1 else trimesh.util.concatenate(meshes)
-        else:
-            mesh = loaded
-        return int(len(mesh.faces))
+            # Sum per geometry: concatenating would copy every array just to count faces
+            return sum(len(g.faces) for g in loaded.geometry.values() if hasattr(g, "faces"))
+        return int(len(loaded.faces))
     except Exception:
         return 0
 
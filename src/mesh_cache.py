@@ -0,0 +1,110 @@
+"""
+Disk cache for remote mesh generation results (Stability, TRELLIS).
+
+Identical input image(s) + generation parameters reuse the GLB returned last time instead
+of paying for another API call. Entries are evicted least-recently-used at server startup
+and whenever a new GLB is stored.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List
+
+CACHE_DIR = Path("data/mesh_cache")
+MAX_ENTRIES = 64
+TMP_MAX_AGE = 3600  # seconds; older *.tmp files are leftovers of interrupted stores
+
+
+def cache_key(image_paths: List[Path], params: Dict[str, Any]) -> str:
+    """
+    Hash of every input image's bytes plus the canonical JSON of params.
+
+    BLAKE2b (stdlib) is several times faster than SHA-256 on 64-bit CPUs; a 128-bit digest is
+    plenty for cache keys.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for image_path in image_paths:
+        h.update(hashlib.blake2b(Path(image_path).read_bytes(), digest_size=16).digest())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def fetch(key: str, output_path: Path, cache_dir: Path = CACHE_DIR) -> bool:
+    """Copy the cached GLB for key to output_path. Returns False on a cache miss."""
+    cached = cache_dir / f"{key}.glb"
+    if not cached.exists():
+        return False
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        shutil.copyfile(cached, output_path)
+        os.utime(cached)  # mtime = last use, for LRU eviction
+    except FileNotFoundError:
+        return False  # evicted between the check and the copy
+    return True
+
+
+def store(key: str, glb_path: Path, cache_dir: Path = CACHE_DIR):
+    """
+    Add a generated GLB to the cache. Written under a unique temp name, then renamed atomically.
+    Evicts the least recently used entries beyond MAX_ENTRIES.
+    Best-effort: a failure is logged and never fails the generation that produced the GLB.
+    """
+    tmp = None
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=f"{key}.", suffix=".glb.tmp")
+        os.close(fd)
+        shutil.copyfile(glb_path, tmp)
+        os.replace(tmp, cache_dir / f"{key}.glb")
+        tmp = None
+        evict(cache_dir=cache_dir)
+    except OSError as e:
+        print(f"[MESH-CACHE] Failed to cache {key}: {e}")
+    finally:
+        if tmp is not None:
+            Path(tmp).unlink(missing_ok=True)
+
+
+def evict(max_entries: int = MAX_ENTRIES, cache_dir: Path = CACHE_DIR):
+    """
+    Keep only the max_entries most recently used GLBs. Called at server startup and by store().
+    Also removes temp files left behind by stores that were interrupted.
+    """
+    if not cache_dir.exists():
+        return
+
+    now = time.time()
+    for tmp in cache_dir.glob("*.tmp"):
+        try:
+            if now - tmp.stat().st_mtime > TMP_MAX_AGE:
+                tmp.unlink(missing_ok=True)
+        except OSError:
+            pass  # removed concurrently or in use
+
+    entries = list(cache_dir.glob("*.glb"))
+    if len(entries) <= max_entries:
+        return
+
+    def last_used(p: Path) -> float:
+        try:
+            return p.stat().st_mtime
+        except OSError:
+            return 0.0  # deleted by a concurrent eviction
+
+    entries.sort(key=last_used, reverse=True)
+    removed = 0
+    for entry in entries[max_entries:]:
+        try:
+            entry.unlink(missing_ok=True)
+            removed += 1
+        except Exception as e:
+            print(f"[MESH-CACHE] Failed to delete {entry.name}: {e}")
+
+    if removed > 0:
+        print(f"[MESH-CACHE] Evicted {removed} cached mesh(es)")
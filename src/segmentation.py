@@ -1,9 +1,9 @@
 """
-3D mesh segmentation using Open3D and PyMeshLab.
+3D mesh segmentation using Open3D.
+
+Open3D is imported lazily inside each function to keep it out of server startup.
 """
 
-import open3d as o3d
-import pymeshlab as ml
 import numpy as np
 import trimesh
 from pathlib import Path
@@ -12,6 +12,90 @@ from typing import Dict, Any
 from .temp_utils import get_temp_path, safe_delete
 
 
+def _write_segmented_mesh(o3d, output_path: Path, mesh) -> None:
+    """
+    Write a segmented mesh as binary, without vertex normals.
+
+    Only positions, faces and vertex colors are read back by segment_mesh_glb.
+    """
+    o3d.io.write_triangle_mesh(
+        str(output_path), mesh,
+        write_ascii=False,
+        compressed=True,
+        write_vertex_normals=False
+    )
+
+
+def _vertex_triangle_csr(triangles: np.ndarray, num_vertices: int):
+    """
+    Build the vertex -> adjacent triangles incidence as CSR arrays.
+
+    Triangles adjacent to vertex v are indices[indptr[v]:indptr[v + 1]].
+    """
+    flat_v = triangles.ravel()
+    flat_t = np.repeat(np.arange(len(triangles), dtype=np.int32), 3)
+    order = np.argsort(flat_v, kind='stable')
+    indices = flat_t[order]
+    indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(flat_v, minlength=num_vertices), out=indptr[1:])
+    return indptr, indices
+
+
+def _majority_vote(
+    triangles: np.ndarray,
+    triangle_labels: np.ndarray,
+    num_vertices: int
+):
+    """
+    Assign each vertex the most frequent label among its adjacent triangles.
+
+    Ties go to the smallest label. Returns (vertex_labels, has_vote) where
+    has_vote is False for vertices not referenced by any triangle.
+    """
+    indptr, indices = _vertex_triangle_csr(triangles, num_vertices)
+    counts_per_vertex = np.diff(indptr)
+    vertex_ids = np.repeat(np.arange(num_vertices), counts_per_vertex)
+    labels = np.asarray(triangle_labels)[indices]
+
+    # Count (vertex, label) pairs, then keep the best label per vertex
+    num_labels = int(labels.max()) + 1 if len(labels) > 0 else 1
+    keys, votes = np.unique(vertex_ids * num_labels + labels, return_counts=True)
+    key_vertex = keys // num_labels
+    key_label = keys % num_labels
+    order = np.lexsort((key_label, -votes, key_vertex))
+    _, first = np.unique(key_vertex[order], return_index=True)
+    best = order[first]
+
+    vertex_labels = np.zeros(num_vertices, dtype=np.int64)
+    vertex_labels[key_vertex[best]] = key_label[best]
+    return vertex_labels, counts_per_vertex > 0
+
+
+def _edge_triangle_pairs(triangles: np.ndarray):
+    """
+    Group triangles by shared undirected edge.
+
+    Returns (num_boundary_edges, tri_a, tri_b) where tri_a[i], tri_b[i] (int32) are the two
+    triangles sharing the i-th manifold edge. Non-manifold edges (3+ triangles) are skipped.
+    """
+    # One uint64 key per edge slot: (max << 32) | min. Slot k belongs to triangle k // 3
+    v0 = triangles.ravel()
+    v1 = triangles[:, [1, 2, 0]].ravel()
+    lo = np.minimum(v0, v1).astype(np.uint64)
+    hi = np.maximum(v0, v1).astype(np.uint64)
+    keys = (hi << np.uint64(32)) | lo
+
+    # Sort slots by key; runs of equal keys are the triangles sharing an edge
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    manifold = starts[counts == 2]
+    tri_a = (order[manifold] // 3).astype(np.int32)
+    tri_b = (order[manifold + 1] // 3).astype(np.int32)
+    return int(np.count_nonzero(counts == 1)), tri_a, tri_b
+
+
 def segment_by_connectivity(
     input_path: Path,
     output_path: Path
@@ -23,6 +107,8 @@ def segment_by_connectivity(
     Speed: very fast (< 1s).
     """
     try:
+        import open3d as o3d
+
         mesh = o3d.io.read_triangle_mesh(str(input_path))
 
         if not mesh.has_vertices():
@@ -37,13 +123,12 @@ def segment_by_connectivity(
         colors = np.random.rand(num_segments, 3)
         vertex_colors = np.zeros((len(mesh.vertices), 3))
 
-        for tri_idx, cluster_id in enumerate(triangle_clusters):
-            triangle = mesh.triangles[tri_idx]
-            for vertex_idx in triangle:
-                vertex_colors[vertex_idx] = colors[cluster_id]
+        # Each vertex takes the color of its last triangle's cluster
+        triangles = np.asarray(mesh.triangles)
+        vertex_colors[triangles.ravel()] = colors[np.repeat(triangle_clusters, 3)]
 
         mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
-        o3d.io.write_triangle_mesh(str(output_path), mesh)
+        _write_segmented_mesh(o3d, output_path, mesh)
 
         return {
             'success': True,
@@ -70,7 +155,8 @@ def segment_by_sharp_edges(
     angle_threshold: minimum angle in degrees to classify an edge as sharp.
     """
     try:
-        # Charger avec Open3D
+        import open3d as o3d
+
         mesh = o3d.io.read_triangle_mesh(str(input_path))
 
         if not mesh.has_vertices():
@@ -80,7 +166,7 @@ def segment_by_sharp_edges(
 
         vertices = np.asarray(mesh.vertices)
         triangles = np.asarray(mesh.triangles)
-        triangle_normals = np.asarray(mesh.triangle_normals)
+        triangle_normals = np.asarray(mesh.triangle_normals, dtype=np.float32)
 
         num_vertices = len(vertices)
         num_triangles = len(triangles)
@@ -90,46 +176,29 @@ def segment_by_sharp_edges(
         print(f"  [SHARP_EDGES] Detecting sharp edges, threshold: {angle_threshold} deg")
         print(f"  Mesh: {num_vertices} vertices, {num_triangles} triangles")
 
-        # edge_dict[edge] = [triangle_indices]
-        edge_dict = {}
-
-        for tri_idx, triangle in enumerate(triangles):
-            edges = [
-                tuple(sorted([triangle[0], triangle[1]])),
-                tuple(sorted([triangle[1], triangle[2]])),
-                tuple(sorted([triangle[2], triangle[0]]))
-            ]
-
-            for edge in edges:
-                if edge not in edge_dict:
-                    edge_dict[edge] = []
-                edge_dict[edge].append(tri_idx)
-
-        sharp_edges = set()
-
-        for edge, tri_indices in edge_dict.items():
-            if len(tri_indices) == 1:
-                # Boundary edge: always sharp
-                sharp_edges.add(edge)
-            elif len(tri_indices) == 2:
-                n1 = triangle_normals[tri_indices[0]]
-                n2 = triangle_normals[tri_indices[1]]
-                cos_angle = np.clip(np.dot(n1, n2), -1.0, 1.0)
-                if np.arccos(cos_angle) > threshold_rad:
-                    sharp_edges.add(edge)
-
-        print(f"  [SHARP_EDGES] Detected {len(sharp_edges)} sharp edges")
-
-        from scipy.sparse import lil_matrix
+        # Triangle pairs sharing each manifold edge; boundary edges are always sharp
+        num_boundary_edges, tri_a, tri_b = _edge_triangle_pairs(triangles)
+
+        cos_angles = np.clip(
+            np.einsum('ij,ij->i', triangle_normals[tri_a], triangle_normals[tri_b]), -1.0, 1.0
+        )
+        sharp = np.arccos(cos_angles) > threshold_rad
+
+        num_sharp_edges = num_boundary_edges + int(np.count_nonzero(sharp))
+
+        print(f"  [SHARP_EDGES] Detected {num_sharp_edges} sharp edges")
+
+        from scipy.sparse import coo_matrix
         from scipy.sparse.csgraph import connected_components
 
         # Build triangle adjacency graph, excluding sharp edges
-        adjacency = lil_matrix((num_triangles, num_triangles), dtype=bool)
-
-        for edge, tri_indices in edge_dict.items():
-            if edge not in sharp_edges and len(tri_indices) == 2:
-                adjacency[tri_indices[0], tri_indices[1]] = True
-                adjacency[tri_indices[1], tri_indices[0]] = True
+        # (one direction is enough: connected_components(directed=False) symmetrizes)
+        smooth_a = tri_a[~sharp]
+        smooth_b = tri_b[~sharp]
+        adjacency = coo_matrix(
+            (np.ones(len(smooth_a), dtype=bool), (smooth_a, smooth_b)),
+            shape=(num_triangles, num_triangles)
+        )
 
         num_segments, triangle_labels = connected_components(adjacency, directed=False)
 
@@ -139,26 +208,16 @@ def segment_by_sharp_edges(
 
         # Assign vertex colors by majority vote from adjacent triangles
         vertex_colors = np.zeros((num_vertices, 3))
-        vertex_segment_votes = [[] for _ in range(num_vertices)]
-
-        for tri_idx, triangle in enumerate(triangles):
-            segment_id = triangle_labels[tri_idx]
-            for vertex_idx in triangle:
-                vertex_segment_votes[vertex_idx].append(segment_id)
-
-        for v_idx in range(num_vertices):
-            if vertex_segment_votes[v_idx]:
-                segment_id = max(set(vertex_segment_votes[v_idx]),
-                               key=vertex_segment_votes[v_idx].count)
-                vertex_colors[v_idx] = segment_colors[segment_id]
+        vertex_labels, has_vote = _majority_vote(triangles, triangle_labels, num_vertices)
+        vertex_colors[has_vote] = segment_colors[vertex_labels[has_vote]]
 
         mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
-        o3d.io.write_triangle_mesh(str(output_path), mesh)
+        _write_segmented_mesh(o3d, output_path, mesh)
 
         return {
             'success': True,
             'num_segments': num_segments,
-            'num_sharp_edges': len(sharp_edges),
+            'num_sharp_edges': num_sharp_edges,
             'method': 'sharp_edges',
             'angle_threshold': angle_threshold
         }
@@ -182,6 +241,7 @@ def segment_by_curvature(
     Speed: moderate (3-10s depending on mesh size).
     """
     try:
+        import open3d as o3d
         from sklearn.cluster import KMeans
 
         mesh = o3d.io.read_triangle_mesh(str(input_path))
@@ -200,49 +260,46 @@ def segment_by_curvature(
 
         print(f"  [CURVATURE] Computing curvature for {num_vertices} vertices")
 
-        # vertex -> adjacent triangle indices
-        vertex_to_triangles = [[] for _ in range(num_vertices)]
-        for tri_idx, triangle in enumerate(triangles):
-            for vertex_idx in triangle:
-                vertex_to_triangles[vertex_idx].append(tri_idx)
-
-        # Curvature = variance of angles between vertex normal and adjacent triangle normals
-        curvatures = np.zeros(num_vertices)
-
-        for v_idx in range(num_vertices):
-            adjacent_tris = vertex_to_triangles[v_idx]
-
-            if len(adjacent_tris) < 2:
-                # Isolated vertex or boundary -> zero curvature
-                curvatures[v_idx] = 0.0
-                continue
-
-            vertex_normal = vertex_normals[v_idx]
-            angles = []
-            for tri_idx in adjacent_tris:
-                tri_verts = triangles[tri_idx]
-                v0, v1, v2 = vertices[tri_verts[0]], vertices[tri_verts[1]], vertices[tri_verts[2]]
-                edge1 = v1 - v0
-                edge2 = v2 - v0
-                tri_normal = np.cross(edge1, edge2)
-                norm = np.linalg.norm(tri_normal)
-                if norm > 0:
-                    tri_normal = tri_normal / norm
-                    cos_angle = np.clip(np.dot(vertex_normal, tri_normal), -1.0, 1.0)
-                    angles.append(np.arccos(cos_angle))
+        # vertex -> adjacent triangle indices (CSR)
+        indptr, indices = _vertex_triangle_csr(triangles, num_vertices)
+
+        # Unit triangle normals, one cross product per face (degenerate faces are skipped).
+        # Kept in float64: on smooth meshes the angles are tiny (cos ~ 1) and float32 arccos loses them
+        tri_verts = vertices[triangles]
+        tri_normals = np.cross(tri_verts[:, 1] - tri_verts[:, 0], tri_verts[:, 2] - tri_verts[:, 0])
+        tri_norms = np.linalg.norm(tri_normals, axis=1)
+        tri_valid = tri_norms > 0
+        tri_normals[tri_valid] /= tri_norms[tri_valid, np.newaxis]
+
+        # Curvature = variance of angles between vertex normal and adjacent triangle normals.
+        # One flat (vertex, triangle) list; vertices with < 2 adjacent triangles keep zero curvature.
+        counts = np.diff(indptr)
+        pair_vertex = np.repeat(np.arange(num_vertices), counts)
+        keep = tri_valid[indices] & (counts >= 2)[pair_vertex]
+        pair_vertex = pair_vertex[keep]
+        pair_tri = indices[keep]
+
+        cos_angles = np.clip(
+            np.einsum('ij,ij->i', tri_normals[pair_tri], vertex_normals[pair_vertex]), -1.0, 1.0
+        )
+        angles = np.arccos(cos_angles)
 
-            if len(angles) > 0:
-                curvatures[v_idx] = np.var(angles)
+        n_angles = np.bincount(pair_vertex, minlength=num_vertices)
+        safe_n = np.maximum(n_angles, 1)
+        angle_mean = np.bincount(pair_vertex, weights=angles, minlength=num_vertices) / safe_n
+        deviations = angles - angle_mean[pair_vertex]
+        curvatures = np.bincount(pair_vertex, weights=deviations * deviations, minlength=num_vertices) / safe_n
 
-        print(f"  [CURVATURE] Curvature min: {curvatures.min():.4f}, max: {curvatures.max():.4f}")
+        curvature_min = float(curvatures.min())
+        curvature_max = float(curvatures.max())
+        print(f"  [CURVATURE] Curvature min: {curvature_min:.4f}, max: {curvature_max:.4f}")
 
-        curvature_mean = curvatures.mean()
-        curvature_std = curvatures.std()
+        # Center once; the std and the normalization share the centered array
+        curvatures_normalized = curvatures - curvatures.mean()
+        curvature_std = np.sqrt(np.mean(curvatures_normalized * curvatures_normalized))
 
         if curvature_std > 0:
-            curvatures_normalized = (curvatures - curvature_mean) / curvature_std
-        else:
-            curvatures_normalized = curvatures - curvature_mean
+            curvatures_normalized /= curvature_std
 
         X = curvatures_normalized.reshape(-1, 1)
 
@@ -255,7 +312,7 @@ def segment_by_curvature(
         vertex_colors = cluster_colors[vertex_labels]
 
         mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
-        o3d.io.write_triangle_mesh(str(output_path), mesh)
+        _write_segmented_mesh(o3d, output_path, mesh)
 
         cluster_sizes = [int(np.sum(vertex_labels == i)) for i in range(num_clusters)]
 
@@ -263,7 +320,7 @@ def segment_by_curvature(
             'success': True,
             'num_segments': num_clusters,
             'cluster_sizes': cluster_sizes,
-            'curvature_range': [float(curvatures.min()), float(curvatures.max())],
+            'curvature_range': [curvature_min, curvature_max],
             'method': 'curvature'
         }
 
@@ -287,6 +344,7 @@ def segment_by_planes(
     Speed: fast (1-3s).
     """
     try:
+        import open3d as o3d
         from sklearn.cluster import KMeans
 
         mesh = o3d.io.read_triangle_mesh(str(input_path))
@@ -376,21 +434,11 @@ def segment_by_planes(
 
         # Assign vertex colors by majority vote from adjacent triangles
         vertex_colors = np.zeros((num_vertices, 3))
-        vertex_label_votes = [[] for _ in range(num_vertices)]
-
-        for tri_idx, triangle in enumerate(triangles):
-            label = triangle_labels[tri_idx]
-            for vertex_idx in triangle:
-                vertex_label_votes[vertex_idx].append(label)
-
-        for v_idx in range(num_vertices):
-            if vertex_label_votes[v_idx]:
-                label = max(set(vertex_label_votes[v_idx]),
-                          key=vertex_label_votes[v_idx].count)
-                vertex_colors[v_idx] = plane_colors[label]
+        vertex_labels, has_vote = _majority_vote(triangles, triangle_labels, num_vertices)
+        vertex_colors[has_vote] = plane_colors[vertex_labels[has_vote]]
 
         mesh.vertex_colors = o3d.utility.Vector3dVector(vertex_colors)
-        o3d.io.write_triangle_mesh(str(output_path), mesh)
+        _write_segmented_mesh(o3d, output_path, mesh)
 
         plane_sizes = [int(np.sum(triangle_labels == i)) for i in range(num_planes)]
 
@@ -461,7 +509,7 @@ def segment_mesh_glb(
     temp_dir: Path = None,
     **kwargs
 ) -> Dict[str, Any]:
-    """Segment a GLB mesh via temporary OBJ conversion. Pipeline: GLB -> OBJ -> segment -> OBJ -> GLB."""
+    """Segment a GLB mesh via temporary PLY conversion. Pipeline: GLB -> PLY -> segment -> PLY -> GLB."""
     if temp_dir is None:
         temp_dir = Path("data/temp")
 
@@ -493,11 +541,12 @@ def segment_mesh_glb(
         original_vertices = len(mesh.vertices)
         original_faces = len(mesh.faces)
 
-        temp_in = get_temp_path("segment_in", ".obj", temp_dir)
-        mesh.export(str(temp_in), file_type='obj')
-        print(f"[SEGMENTATION-GLB] Temp OBJ created: {temp_in.name}")
+        # Binary PLY with float32 vertices: half the bytes of float64 and no ASCII formatting
+        temp_in = get_temp_path("segment_in", ".ply", temp_dir)
+        mesh.export(str(temp_in), file_type='ply')
+        print(f"[SEGMENTATION-GLB] Temp PLY created: {temp_in.name}")
 
-        temp_out = get_temp_path("segment_out", ".obj", temp_dir)
+        temp_out = get_temp_path("segment_out", ".ply", temp_dir)
 
         result = segment_mesh(
             input_path=temp_in,
@@ -511,6 +560,7 @@ def segment_mesh_glb(
 
         print(f"[SEGMENTATION-GLB] Converting result to GLB")
 
+        import open3d as o3d
         o3d_mesh = o3d.io.read_triangle_mesh(str(temp_out))
         vertices = np.asarray(o3d_mesh.vertices)
         faces = np.asarray(o3d_mesh.triangles)
@@ -559,8 +609,4 @@ def segment_mesh_glb(
     finally:
         safe_delete(temp_in)
         safe_delete(temp_out)
-        # Also delete the .mtl that accompanies the .obj
-        if temp_out:
-            mtl_file = temp_out.with_suffix('.mtl')
-            safe_delete(mtl_file)
         print(f"[SEGMENTATION-GLB] Temp files cleaned up")
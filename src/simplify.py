@@ -1,16 +1,29 @@
 """
 3D mesh simplification using pyfqmr Quadric Error Metric (QEM). GLB-first.
+Falls back to fast-simplification when pyfqmr is not installed.
 
 When preserve_texture=True: pyfqmr simplifies geometry, then vertex colors
 are sampled from the original texture via closest-point + barycentric projection.
 No LSCM, no rasterization — fast and works on non-watertight meshes.
 """
 
+import os
+import atexit
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, Union
 import trimesh
 import numpy as np
-import pyfqmr
+
+try:
+    import pyfqmr
+except ImportError:  # fall back to fast-simplification (already a trimesh dependency)
+    pyfqmr = None
+
+QEM_AGGRESSIVENESS = 7
 
 
 def _sample_vertex_colors(
@@ -50,20 +63,117 @@ def _sample_vertex_colors(
     return colors
 
 
+def _max_iterations_for_error(max_error: float) -> int:
+    """
+    Number of pyfqmr passes before its collapse threshold exceeds max_error.
+
+    pyfqmr grows the threshold as alpha * (iteration + K) ** aggressiveness,
+    so capping the iterations stops decimation once collapses would cost more
+    than max_error, even if target_count is not reached yet.
+    0 means even the first pass would exceed max_error; capped at pyfqmr's default of 100.
+    """
+    alpha, k = 1e-9, 3
+    return min(100, max(0, int((max_error / alpha) ** (1.0 / QEM_AGGRESSIVENESS)) - k + 1))
+
+
+def _qem_simplify(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    target_count: int,
+    preserve_border: bool = True,
+    max_error: float = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run QEM decimation on raw arrays. Returns (vertices, faces).
+
+    Uses pyfqmr, or fast-simplification when pyfqmr is not installed.
+    preserve_border keeps open-border vertices in place (non-watertight meshes).
+    max_error (quadric error, ~squared distance) stops early; pyfqmr only.
+    Inputs are only converted when their dtype/layout differs from what the backend expects.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+    faces = np.ascontiguousarray(faces, dtype=np.int32)
+    if pyfqmr is not None:
+        max_iterations = _max_iterations_for_error(max_error) if max_error is not None else 100
+        if max_iterations == 0:
+            return vertices, faces  # no collapse is cheap enough
+        simplifier = pyfqmr.Simplify()
+        simplifier.setMesh(vertices, faces)
+        simplifier.simplify_mesh(
+            target_count=target_count,
+            aggressiveness=QEM_AGGRESSIVENESS,
+            max_iterations=max_iterations,
+            preserve_border=preserve_border,
+            verbose=False,
+        )
+        verts, faces_out, _ = simplifier.getMesh()
+        return verts, faces_out
+
+    if max_error is not None:
+        print("[SIMPLIFY] max_error is not supported by fast-simplification, ignoring")
+    import fast_simplification
+    return fast_simplification.simplify(
+        vertices,
+        faces,
+        target_count=target_count,
+        agg=QEM_AGGRESSIVENESS,
+        preserve_border=preserve_border,
+    )
+
+
+def _simplify_stats(
+    original_vertices: int,
+    original_triangles: int,
+    simplified_vertices: int,
+    simplified_triangles: int,
+    output_path: Optional[Path],
+    has_textures: bool,
+    texture_transferred: bool,
+    textures_lost: bool,
+    is_watertight: bool
+) -> Dict[str, Any]:
+    """Build the result dict returned by simplify_mesh_glb. Ratios are derived from the removed counts.
+    output_path=None (in-memory mode) reports no output file."""
+    vertices_removed = original_vertices - simplified_vertices
+    triangles_removed = original_triangles - simplified_triangles
+    return {
+        'success': True,
+        'original_vertices': original_vertices,
+        'original_triangles': original_triangles,
+        'simplified_vertices': simplified_vertices,
+        'simplified_triangles': simplified_triangles,
+        'vertices_ratio': vertices_removed / original_vertices if original_vertices > 0 else 0,
+        'triangles_ratio': triangles_removed / original_triangles if original_triangles > 0 else 0,
+        'vertices_removed': vertices_removed,
+        'triangles_removed': triangles_removed,
+        'output_file': str(output_path) if output_path is not None else None,
+        'output_size': output_path.stat().st_size if output_path is not None else 0,
+        'has_textures': has_textures,
+        'textures_lost': textures_lost,
+        'texture_transferred': texture_transferred,
+        'is_watertight': is_watertight
+    }
+
+
 def simplify_mesh_glb(
     input_path: Path,
-    output_path: Path,
+    output_path: Optional[Path],
     target_triangles: int = None,
     reduction_ratio: float = None,
     preserve_texture: bool = False,
-    temp_dir: Path = Path("data/temp")
+    temp_dir: Path = Path("data/temp"),
+    preserve_border: bool = True,
+    max_error: Optional[Union[float, str]] = None
 ) -> Dict[str, Any]:
     """
-    Simplify a GLB using Quadric Error Metric (pyfqmr).
+    Simplify a GLB using Quadric Error Metric (pyfqmr or fast-simplification).
 
     preserve_texture=True: samples vertex colors from original texture via
     closest-point projection after simplification. No LSCM, no rasterization.
     target_triangles takes priority over reduction_ratio.
+    max_error stops decimation early once collapses exceed that quadric error;
+    "auto" uses (1% of the bounding box diagonal) squared.
+    output_path=None skips the export and returns the mesh under 'mesh' instead.
     """
     try:
         if not input_path.exists():
@@ -72,15 +182,8 @@ def simplify_mesh_glb(
         if target_triangles is None and reduction_ratio is None:
             return {'success': False, 'error': "Specify target_triangles or reduction_ratio"}
 
-        loaded = trimesh.load(str(input_path))
-
-        if hasattr(loaded, 'geometry'):
-            meshes = list(loaded.geometry.values())
-            if not meshes:
-                return {'success': False, 'error': 'Empty scene, no geometry'}
-            mesh = meshes[0] if len(meshes) == 1 else trimesh.util.concatenate(meshes)
-        else:
-            mesh = loaded
+        # Scenes are flattened into a single mesh by trimesh itself
+        mesh = trimesh.load(str(input_path), force='mesh')
 
         if not hasattr(mesh, 'vertices') or len(mesh.vertices) == 0:
             return {'success': False, 'error': 'No valid vertices'}
@@ -100,56 +203,130 @@ def simplify_mesh_glb(
             target_triangles = int(original_triangles * (1 - reduction_ratio))
         target_triangles = max(4, min(int(target_triangles), original_triangles))
 
-        # pyfqmr: geometry-only QEM, preserve_border=True for non-watertight meshes
-        simplifier = pyfqmr.Simplify()
-        simplifier.setMesh(
-            mesh.vertices.astype(np.float64),
-            mesh.faces.astype(np.int32)
-        )
-        simplifier.simplify_mesh(
-            target_count=target_triangles,
-            aggressiveness=7,
-            preserve_border=True,
-            verbose=False,
+        if target_triangles >= original_triangles:
+            # Nothing to collapse: skip QEM and keep the input as-is (textures included)
+            print(f"[SIMPLIFY] Target {target_triangles} >= {original_triangles} triangles, no simplification needed")
+            if output_path is not None:
+                if input_path.suffix.lower() == '.glb':
+                    shutil.copyfile(input_path, output_path)
+                else:
+                    mesh.export(str(output_path), file_type='glb')
+            stats = _simplify_stats(
+                original_vertices, original_triangles,
+                original_vertices, original_triangles,
+                output_path,
+                has_textures=has_textures,
+                texture_transferred=False,
+                textures_lost=False,
+                is_watertight=bool(mesh.is_watertight)
+            )
+            if output_path is None:
+                stats['mesh'] = mesh
+            return stats
+
+        if max_error == "auto":
+            max_error = (0.01 * float(mesh.scale)) ** 2
+
+        # Only texture sampling needs the original mesh after QEM. Otherwise keep just
+        # the raw arrays so the parsed mesh (visuals, caches) can be freed.
+        high_poly = mesh if preserve_texture and has_textures else None
+        original_verts, original_faces = mesh.vertices, mesh.faces
+        del mesh
+
+        # Geometry-only QEM on raw arrays
+        verts, faces = _qem_simplify(
+            original_verts, original_faces, target_triangles,
+            preserve_border=preserve_border,
+            max_error=max_error
         )
-        verts, faces, _ = simplifier.getMesh()
+        del original_verts, original_faces
+        simplified_vertices = len(verts)
+        simplified_triangles = len(faces)
         mesh_simplified = trimesh.Trimesh(vertices=verts, faces=faces, process=False)
 
         texture_transferred = False
-        if preserve_texture and has_textures:
-            colors = _sample_vertex_colors(mesh, verts)
+        if high_poly is not None:
+            colors = _sample_vertex_colors(high_poly, verts)
             if colors is not None:
                 mesh_simplified.visual = trimesh.visual.ColorVisuals(
                     mesh=mesh_simplified,
                     vertex_colors=colors
                 )
                 texture_transferred = True
-                print(f"[SIMPLIFY] Vertex colors sampled: {len(verts)} vertices")
+                print(f"[SIMPLIFY] Vertex colors sampled: {simplified_vertices} vertices")
             else:
                 print("[SIMPLIFY] No texture found — exporting without colors")
 
-        mesh_simplified.export(str(output_path), file_type='glb')
-
-        simplified_vertices = len(mesh_simplified.vertices)
-        simplified_triangles = len(mesh_simplified.faces)
-
-        return {
-            'success': True,
-            'original_vertices': original_vertices,
-            'original_triangles': original_triangles,
-            'simplified_vertices': simplified_vertices,
-            'simplified_triangles': simplified_triangles,
-            'vertices_ratio': 1 - (simplified_vertices / original_vertices) if original_vertices > 0 else 0,
-            'triangles_ratio': 1 - (simplified_triangles / original_triangles) if original_triangles > 0 else 0,
-            'vertices_removed': original_vertices - simplified_vertices,
-            'triangles_removed': original_triangles - simplified_triangles,
-            'output_file': str(output_path),
-            'output_size': output_path.stat().st_size,
-            'has_textures': has_textures,
-            'textures_lost': has_textures and not texture_transferred,
-            'texture_transferred': texture_transferred,
-            'is_watertight': bool(mesh_simplified.is_watertight)
-        }
+        if output_path is not None:
+            mesh_simplified.export(str(output_path), file_type='glb')
+
+        stats = _simplify_stats(
+            original_vertices, original_triangles,
+            simplified_vertices, simplified_triangles,
+            output_path,
+            has_textures=has_textures,
+            texture_transferred=texture_transferred,
+            textures_lost=has_textures and not texture_transferred,
+            is_watertight=bool(mesh_simplified.is_watertight)
+        )
+        if output_path is None:
+            stats['mesh'] = mesh_simplified
+        return stats
 
     except Exception as e:
         return {'success': False, 'error': f"Erreur simplification GLB: {str(e)}"}
+
+
+def _simplify_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one simplify_mesh_glb call from a kwargs dict. Module-level so process pools can pickle it."""
+    return simplify_mesh_glb(**job)
+
+
+POOL_WORKERS = 3  # A LOD batch is 3 jobs (LOD1-LOD3); bigger batches just queue
+# Below this many source faces a whole LOD batch finishes in well under a second
+# in-process, less than the cost of shipping jobs to (or spawning) workers
+PARALLEL_MIN_FACES = 200_000
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared worker pool, created on first use so spawned workers are paid for once."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=min(POOL_WORKERS, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def simplify_meshes_glb(
+    jobs: List[Dict[str, Any]],
+    max_workers: int = None,
+    source_faces: int = None
+) -> List[Dict[str, Any]]:
+    """
+    Run several simplify_mesh_glb calls in parallel worker processes.
+
+    jobs: list of simplify_mesh_glb keyword arguments. Results come back in job order.
+    QEM is single-threaded native code, so independent jobs scale with processes.
+    Workers are spawned (not forked) because the server process runs threads.
+    Without max_workers, jobs go to a shared pool that lives for the whole process.
+    source_faces: face count of the input; small meshes are simplified in-process.
+    """
+    small = source_faces is not None and source_faces < PARALLEL_MIN_FACES
+    if len(jobs) <= 1 or small:
+        return [_simplify_job(job) for job in jobs]
+
+    if max_workers is None:
+        return list(_get_pool().map(_simplify_job, jobs))
+
+    with ProcessPoolExecutor(
+        max_workers=min(len(jobs), max_workers),
+        mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return list(executor.map(_simplify_job, jobs))
@@ -2,36 +2,60 @@
 Stability AI Fast 3D mesh generation client. Generates GLB meshes from images via the Stability AI API.
 """
 
+import io
 import time
+import atexit
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import httpx
 import trimesh
 from PIL import Image
 
+from . import mesh_cache
+from .converter import glb_counts
+from .http_retry import RETRY_STATUSES, MAX_ATTEMPTS, retry_delay
+
 
 STABILITY_API_URL = "https://api.stability.ai/v2beta/3d/stable-fast-3d"
+MAX_UPLOAD_SIZE = 1024  # SF3D works at ~1024px; larger inputs are downscaled before upload
+
+@dataclass(frozen=True, slots=True)
+class ResolutionParams:
+    """Stability API parameters for one resolution preset. Immutable, safe to share across threads."""
+    texture_resolution: int
+    vertex_count: int  # -1 = unlimited
+    remesh: str
+
 
 # Resolution to Stability API parameter mapping
 RESOLUTION_PARAMS = {
-    'low': {
-        'texture_resolution': 512,
-        'vertex_count': 5000,
-        'remesh': 'triangle'
-    },
-    'medium': {
-        'texture_resolution': 1024,
-        'vertex_count': 10000,
-        'remesh': 'none'
-    },
-    'high': {
-        'texture_resolution': 2048,
-        'vertex_count': -1,  # Unlimited
-        'remesh': 'none'
-    }
+    'low': ResolutionParams(texture_resolution=512, vertex_count=5000, remesh='triangle'),
+    'medium': ResolutionParams(texture_resolution=1024, vertex_count=10000, remesh='none'),
+    'high': ResolutionParams(texture_resolution=2048, vertex_count=-1, remesh='none'),
 }
 
 
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def _get_client() -> httpx.Client:
+    """Shared HTTP/2 client, so consecutive generations reuse the TLS connection."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(120.0, connect=10.0),
+                limits=httpx.Limits(max_keepalive_connections=16, max_connections=32, keepalive_expiry=60.0)
+            )
+            atexit.register(_client.close)
+        return _client
+
+
 class StabilityAPIError(Exception):
     """Raised when the Stability API returns an error."""
     def __init__(self, status_code: int, message: str):
@@ -55,18 +79,55 @@ def _translate_error(status_code: int, api_message: str) -> str:
     return f"{user_message} | Details: {api_message}"
 
 
+def _prepare_image(image_path: Path, strict: bool = False) -> Tuple[tuple, Optional[bytes], str]:
+    """
+    Open the input image once: validate it from its header and downscale it in memory if needed.
+
+    Returns (original_size, upload_bytes, mime_type). upload_bytes is None when the file is small
+    enough to be uploaded as is. strict=True additionally runs PIL's full verify().
+    """
+    if strict:
+        with Image.open(image_path) as img:
+            img.verify()  # leaves the image unusable, hence the second open below
+
+    with Image.open(image_path) as img:  # lazy: reads the header only
+        size = img.size
+        if max(size) <= MAX_UPLOAD_SIZE:
+            return size, None, Image.MIME.get(img.format, 'image/jpeg')
+
+        buf = io.BytesIO()
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Keep alpha: SF3D uses it as the foreground mask
+            img.thumbnail((MAX_UPLOAD_SIZE, MAX_UPLOAD_SIZE), Image.Resampling.LANCZOS)
+            img.save(buf, format='PNG')
+            mime_type = 'image/png'
+        else:
+            img.draft('RGB', (MAX_UPLOAD_SIZE, MAX_UPLOAD_SIZE))  # JPEG: decode at reduced scale
+            img.thumbnail((MAX_UPLOAD_SIZE, MAX_UPLOAD_SIZE), Image.Resampling.LANCZOS)
+            img.convert('RGB').save(buf, format='JPEG', quality=92)
+            mime_type = 'image/jpeg'
+
+    return size, buf.getvalue(), mime_type
+
+
 def _call_stability_api(
     image_path: Path,
+    output_path: Path,
     texture_resolution: int,
     foreground_ratio: float,
     remesh: str,
     vertex_count: int,
-    api_key: str
-) -> bytes:
+    api_key: str,
+    image_bytes: Optional[bytes] = None,
+    mime_type: str = 'image/jpeg'
+) -> int:
     """
-    Low-level Stability API call. Returns raw GLB bytes.
+    Low-level Stability API call. Streams the returned GLB to output_path, returns its size in bytes.
 
-    Raises StabilityAPIError on non-200 responses.
+    The image is uploaded from image_bytes when given (downscaled input), otherwise streamed
+    from disk by httpx's multipart encoder. The GLB is written chunk by chunk.
+    Rate limiting (429/5xx, honoring Retry-After) and connection failures are retried with backoff.
+    Raises StabilityAPIError on other non-200 responses, or once retries are exhausted.
     """
     print(f"  [STABILITY-API] Calling Fast 3D API")
     print(f"    Image: {image_path.name}")
@@ -74,39 +135,69 @@ def _call_stability_api(
     print(f"    Vertex count: {vertex_count if vertex_count > 0 else 'unlimited'}")
     print(f"    Remesh: {remesh}")
 
-    with open(image_path, 'rb') as img_file:
-        files = {'image': (image_path.name, img_file, 'image/jpeg')}
-        data = {
-            'texture_resolution': str(texture_resolution),
-            'foreground_ratio': str(foreground_ratio),
-            'remesh': remesh,
-            'vertex_count': str(vertex_count)
-        }
-        headers = {'authorization': api_key}
+    data = {
+        'texture_resolution': str(texture_resolution),
+        'foreground_ratio': str(foreground_ratio),
+        'remesh': remesh,
+        'vertex_count': str(vertex_count)
+    }
+    headers = {'authorization': api_key}
+    client = _get_client()
 
-        with httpx.Client(timeout=120.0) as client:
-            response = client.post(
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+
+        with open(image_path, 'rb') if image_bytes is None else nullcontext(image_bytes) as content:
+            files = {'image': (image_path.name, content, mime_type)}
+            request = client.build_request(
+                "POST",
                 STABILITY_API_URL,
                 files=files,
                 data=data,
                 headers=headers
             )
-
-        if response.status_code == 200:
-            file_size_kb = len(response.content) / 1024
-            print(f"  [OK] API call successful, received {file_size_kb:.1f} KB")
-            return response.content
-        else:
             try:
-                error_json = response.json()
-                error_message = error_json.get('message', response.text)
-            except:
-                error_message = response.text
-
-            raise StabilityAPIError(
-                status_code=response.status_code,
-                message=error_message
-            )
+                response = client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # Never reached the server: safe to retry, no credits spent
+                if last_attempt:
+                    raise
+                delay = retry_delay(attempt)
+                print(f"  [STABILITY-API] Connection failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+        try:
+            if response.status_code == 200:
+                size = 0
+                with open(output_path, 'wb') as out:
+                    for chunk in response.iter_bytes(1 << 16):
+                        out.write(chunk)
+                        size += len(chunk)
+                print(f"  [OK] API call successful, received {size / 1024:.1f} KB")
+                return size
+
+            response.read()
+            retry_after = response.headers.get('Retry-After')
+        finally:
+            response.close()
+
+        if response.status_code in RETRY_STATUSES and not last_attempt:
+            delay = retry_delay(attempt, retry_after)
+            print(f"  [STABILITY-API] HTTP {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        try:
+            error_json = response.json()
+            error_message = error_json.get('message', response.text)
+        except:
+            error_message = response.text
+
+        raise StabilityAPIError(
+            status_code=response.status_code,
+            message=error_message
+        )
 
 
 def generate_mesh_from_image_sf3d(
@@ -114,12 +205,15 @@ def generate_mesh_from_image_sf3d(
     output_path: Path,
     resolution: str = "medium",
     remesh_option: str = None,
-    api_key: Optional[str] = None
+    api_key: Optional[str] = None,
+    strict: bool = False
 ) -> Dict:
     """
     Generate a 3D mesh from an image using Stability AI Fast 3D.
 
     GLB-First: the API returns GLB natively, so output_path must be a .glb.
+    The image is validated from its header only (strict=True also runs PIL's full verify())
+    and downscaled in memory to MAX_UPLOAD_SIZE before upload.
     """
     start_time = time.time()
 
@@ -137,51 +231,64 @@ def generate_mesh_from_image_sf3d(
 
     params = RESOLUTION_PARAMS[resolution]
 
-    if remesh_option is not None:
-        params = params.copy()  # Don't mutate the global dict
-        params['remesh'] = remesh_option
+    if remesh_option is not None and remesh_option != params.remesh:
+        params = replace(params, remesh=remesh_option)
 
     print(f"\n [STABILITY-MESH] Generating mesh from image")
     print(f"  Input: {image_path.name}")
     print(f"  Resolution: {resolution}")
-    print(f"  Remesh: {params['remesh']}")
+    print(f"  Remesh: {params.remesh}")
 
     try:
         try:
-            img = Image.open(image_path)
-            img.verify()
-            print(f"  Image validated: {img.size[0]}x{img.size[1]}px")
+            image_size, image_bytes, mime_type = _prepare_image(image_path, strict)
+            print(f"  Image validated: {image_size[0]}x{image_size[1]}px")
+            if image_bytes is not None:
+                print(f"  Downscaled to {MAX_UPLOAD_SIZE}px for upload ({len(image_bytes) / 1024:.1f} KB)")
         except Exception as e:
             return {
                 'success': False,
                 'error': f"Invalid image: {str(e)}"
             }
 
-        glb_bytes = _call_stability_api(
-            image_path=image_path,
-            texture_resolution=params['texture_resolution'],
-            foreground_ratio=0.85,
-            remesh=params['remesh'],
-            vertex_count=params['vertex_count'],
-            api_key=api_key
-        )
-
         # GLB-First: save directly, no conversion needed
         if output_path.suffix.lower() != '.glb':
             output_path = output_path.with_suffix('.glb')
 
-        print(f"  [GLB-First] Saving GLB directly to {output_path.name}")
-        output_path.write_bytes(glb_bytes)
+        foreground_ratio = 0.85
+        key = mesh_cache.cache_key([image_path], {
+            'provider': 'stability',
+            'texture_resolution': params.texture_resolution,
+            'foreground_ratio': foreground_ratio,
+            'remesh': params.remesh,
+            'vertex_count': params.vertex_count
+        })
+        cached = mesh_cache.fetch(key, output_path)
+
+        if cached:
+            print("  [CACHE] Same image and parameters already generated, reusing GLB")
+        else:
+            print(f"  [GLB-First] Saving GLB directly to {output_path.name}")
+            _call_stability_api(
+                image_path=image_path,
+                output_path=output_path,
+                texture_resolution=params.texture_resolution,
+                foreground_ratio=foreground_ratio,
+                remesh=params.remesh,
+                vertex_count=params.vertex_count,
+                api_key=api_key,
+                image_bytes=image_bytes,
+                mime_type=mime_type
+            )
+            mesh_cache.store(key, output_path)
         final_output = output_path
 
-        mesh = trimesh.load(str(final_output))
-        if hasattr(mesh, 'geometry'):
-            meshes = list(mesh.geometry.values())
-            if len(meshes) > 0:
-                mesh = meshes[0] if len(meshes) == 1 else trimesh.util.concatenate(meshes)
-
-        vertices_count = len(mesh.vertices)
-        faces_count = len(mesh.faces)
+        # Counts from the GLB JSON header; only parse the whole file if that fails
+        counts = glb_counts(final_output)
+        if counts is None:
+            mesh = trimesh.load(str(final_output), force='mesh')
+            counts = (len(mesh.vertices), len(mesh.faces))
+        vertices_count, faces_count = counts
         generation_time = (time.time() - start_time) * 1000
 
         print(f"  [OK] Mesh generated successfully")
@@ -196,10 +303,11 @@ def generate_mesh_from_image_sf3d(
             'faces_count': faces_count,
             'resolution': resolution,
             'generation_time_ms': round(generation_time, 2),
-            'api_credits_used': 10,  # SF3D costs 10 credits per generation
+            'api_credits_used': 0 if cached else 10,  # SF3D costs 10 credits per generation
+            'cached': cached,
             'method': 'stability_fast3d',
-            'texture_resolution': params['texture_resolution'],
-            'vertex_count': params['vertex_count']
+            'texture_resolution': params.texture_resolution,
+            'vertex_count': params.vertex_count
         }
 
     except httpx.TimeoutException:
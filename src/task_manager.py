@@ -1,13 +1,20 @@
 """
 Async task queue with thread workers for mesh processing.
+
+Sync handlers run on daemon worker threads fed by a queue. Handlers that return an awaitable (I/O-bound
+polling, e.g. TRELLIS) are finished on a shared asyncio loop thread, so they don't hold
+a worker thread while they wait.
 """
 
-import threading
+import asyncio
+import inspect
 import queue
+import threading
+import time
 import uuid
-import random
-from typing import Dict, Any, Callable
-from datetime import datetime
+from itertools import islice
+from typing import Dict, Any, Awaitable, Callable, List
+from datetime import datetime, timedelta
 from enum import Enum
 
 
@@ -33,6 +40,7 @@ class Task:
         self.created_at = datetime.now()
         self.started_at = None
         self.completed_at = None
+        self.done = threading.Event()  # Set once the task is COMPLETED or FAILED
 
     def to_dict(self) -> Dict[str, Any]:
         """Serialize the task to a dict for the API."""
@@ -53,21 +61,28 @@ class TaskManager:
     """Task queue with thread workers."""
 
     def __init__(self, num_workers: int = 2):
-        self.task_queue = queue.Queue()
         self.tasks: Dict[str, Task] = {}
         self.task_handlers: Dict[str, Callable] = {}
         self.num_workers = num_workers
-        self.workers = []
         self.running = False
         self.lock = threading.Lock()
+        self.task_queue: queue.Queue = queue.Queue()  # Task IDs; None tells a worker to exit
+        self.workers: List[threading.Thread] = []
+        self._loop = None
+        self._loop_thread = None
+        self._loop_cleanups: List[Callable[[], Awaitable]] = []
 
         self.task_ttl_seconds = 3600  # Keep completed tasks for 1 hour
-        self.max_tasks = 1000  # Max tasks in memory
+        self.max_tasks = 1000  # Max tasks in memory; the oldest finished ones are evicted beyond that
 
     def register_handler(self, task_type: str, handler: Callable):
         """Register a handler function for a given task type."""
         self.task_handlers[task_type] = handler
 
+    def register_loop_cleanup(self, cleanup: Callable[[], Awaitable]):
+        """Register a coroutine function that stop() runs on the event loop (e.g. closing loop-bound clients)."""
+        self._loop_cleanups.append(cleanup)
+
     def create_task(self, task_type: str, params: Dict[str, Any]) -> str:
         """Create a task, enqueue it, and return its ID."""
         task_id = str(uuid.uuid4())
@@ -75,112 +90,171 @@ class TaskManager:
 
         with self.lock:
             self.tasks[task_id] = task
+            self._evict_finished()
 
         self.task_queue.put(task_id)
         return task_id
 
+    # Reads are lock-free: single dict get/copy operations are atomic under the GIL,
+    # and task fields are only ever replaced by single attribute stores.
+    # Every mutation of self.tasks happens under self.lock.
+
     def get_task(self, task_id: str) -> Task:
         """Return a task by ID."""
-        with self.lock:
-            return self.tasks.get(task_id)
+        return self.tasks.get(task_id)
 
     def get_all_tasks(self) -> Dict[str, Task]:
         """Return all tasks."""
-        with self.lock:
-            return dict(self.tasks)
+        return self.tasks.copy()
 
-    def cleanup_old_tasks(self):
-        """Remove completed/failed tasks older than task_ttl_seconds. Called periodically by workers."""
-        now = datetime.now()
-        with self.lock:
-            tasks_to_remove = []
+    def _evict_finished(self):
+        """Drop the oldest finished tasks while more than max_tasks are stored. Caller holds self.lock."""
+        excess = len(self.tasks) - self.max_tasks
+        if excess <= 0:
+            return
 
-            for task_id, task in self.tasks.items():
-                if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-                    if task.completed_at:
-                        age = (now - task.completed_at).total_seconds()
-                        if age > self.task_ttl_seconds:
-                            tasks_to_remove.append(task_id)
+        # Dicts keep insertion order: the first finished tasks are the oldest ones
+        finished = (task_id for task_id, task in self.tasks.items() if task.done.is_set())
+        for task_id in list(islice(finished, excess)):
+            del self.tasks[task_id]
 
+    def purge_completed(self, before: datetime) -> int:
+        """Remove completed/failed tasks that finished before the given time. Returns the number removed."""
+        with self.lock:
+            tasks_to_remove = [
+                task_id for task_id, task in self.tasks.items()
+                if task.done.is_set() and task.completed_at and task.completed_at < before
+            ]
             for task_id in tasks_to_remove:
                 del self.tasks[task_id]
+        return len(tasks_to_remove)
 
-            if tasks_to_remove:
-                print(f"[TASK_MANAGER] Cleaned up {len(tasks_to_remove)} old tasks (>{self.task_ttl_seconds}s)")
+    def cleanup_old_tasks(self):
+        """Remove completed/failed tasks older than task_ttl_seconds. Called by workers after each task."""
+        removed = self.purge_completed(datetime.now() - timedelta(seconds=self.task_ttl_seconds))
+        if removed:
+            print(f"[TASK_MANAGER] Cleaned up {removed} old tasks (>{self.task_ttl_seconds}s)")
+
+    def _mark_completed(self, task: Task, result: Any, tag: str):
+        """Record a handler result on the task."""
+        task.status = TaskStatus.COMPLETED
+        task.result = result
+        task.progress = 100
+        task.completed_at = datetime.now()
+        task.done.set()
+
+        duration = (task.completed_at - task.started_at).total_seconds()
+        print(f"[{tag}] Completed task {task.id[:8]} in {duration:.2f}s")
+
+    def _mark_failed(self, task: Task, error: Exception, tag: str):
+        """Record a handler exception on the task."""
+        task.status = TaskStatus.FAILED
+        task.error = str(error)
+        task.completed_at = datetime.now()
+        task.done.set()
+        print(f"[{tag}] Failed task {task.id[:8]}: {str(error)}")
+
+    async def _finish_async(self, task: Task, awaitable):
+        """Await an async handler result on the loop thread and record the outcome."""
+        try:
+            result = await awaitable
+            self._mark_completed(task, result, "EVENT-LOOP")
+        except Exception as e:
+            self._mark_failed(task, e, "EVENT-LOOP")
 
     def _worker(self, worker_id: int):
-        """Thread worker. Processes tasks from the queue until stopped."""
-        print(f"[WORKER-{worker_id}] Started and waiting for tasks...")
-        while self.running:
-            try:
-                # 10% chance of cleanup per iteration to avoid memory leaks
-                if random.random() < 0.1:
-                    self.cleanup_old_tasks()
-
-                task_id = self.task_queue.get(timeout=1)
-
-                with self.lock:
-                    task = self.tasks.get(task_id)
-
-                if task is None:
-                    continue
-
-                task.status = TaskStatus.PROCESSING
-                task.started_at = datetime.now()
-                task.progress = 0
-
-                print(f"[WORKER-{worker_id}] Processing task {task_id[:8]}... (type: {task.type})")
+        """Thread worker. Blocks on the queue (no polling) until it receives the stop sentinel."""
+        tag = f"WORKER-{worker_id}"
+        while True:
+            task_id = self.task_queue.get()
+            if task_id is None:
+                break
+            self._run(task_id, tag)
+
+    def _run(self, task_id: str, tag: str):
+        """Run one task on the calling worker thread."""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
 
-                try:
-                    handler = self.task_handlers.get(task.type)
-                    if handler is None:
-                        raise ValueError(f"No handler for task type: {task.type}")
+        task.status = TaskStatus.PROCESSING
+        task.started_at = datetime.now()
+        task.progress = 0
 
-                    result = handler(task)
+        print(f"[{tag}] Processing task {task_id[:8]}... (type: {task.type})")
 
-                    task.status = TaskStatus.COMPLETED
-                    task.result = result
-                    task.progress = 100
-                    task.completed_at = datetime.now()
+        try:
+            handler = self.task_handlers.get(task.type)
+            if handler is None:
+                raise ValueError(f"No handler for task type: {task.type}")
 
-                    duration = (task.completed_at - task.started_at).total_seconds()
-                    print(f"[WORKER-{worker_id}] Completed task {task_id[:8]} in {duration:.2f}s")
+            result = handler(task)
 
-                except Exception as e:
-                    task.status = TaskStatus.FAILED
-                    task.error = str(e)
-                    task.completed_at = datetime.now()
-                    print(f"[WORKER-{worker_id}] Failed task {task_id[:8]}: {str(e)}")
+            if inspect.isawaitable(result):
+                # Hand the rest over to the event loop and free this worker
+                asyncio.run_coroutine_threadsafe(self._finish_async(task, result), self._loop)
+                print(f"[{tag}] Task {task_id[:8]} continues on the event loop")
+            else:
+                self._mark_completed(task, result, tag)
 
-                finally:
-                    self.task_queue.task_done()
+        except Exception as e:
+            self._mark_failed(task, e, tag)
 
-            except queue.Empty:
-                continue
-        print(f"[WORKER-{worker_id}] Stopped")
+        finally:
+            self.cleanup_old_tasks()
 
     def start(self):
-        """Start the worker threads."""
+        """Start the worker threads and the event loop thread."""
         if self.running:
             return
 
         self.running = True
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+
         print(f"[TASK_MANAGER] Starting {self.num_workers} worker threads...")
         for i in range(self.num_workers):
-            worker = threading.Thread(target=self._worker, args=(i,), daemon=True)
+            # Daemon threads: a long generation never blocks interpreter exit
+            worker = threading.Thread(target=self._worker, args=(i,), name=f"worker-{i}", daemon=True)
             worker.start()
             self.workers.append(worker)
 
     def stop(self):
-        """Stop the worker threads."""
+        """
+        Stop the workers and the event loop. Queued tasks are dropped (they stay PENDING);
+        running tasks get up to 5s to finish, after which their daemon threads are abandoned.
+        """
         self.running = False
+
+        while True:
+            try:
+                self.task_queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self.workers:
+            self.task_queue.put(None)
+
+        deadline = time.monotonic() + 5
         for worker in self.workers:
-            worker.join(timeout=5)
+            worker.join(timeout=max(0.0, deadline - time.monotonic()))
         self.workers = []
 
+        if self._loop is not None:
+            for cleanup in self._loop_cleanups:
+                try:
+                    asyncio.run_coroutine_threadsafe(cleanup(), self._loop).result(timeout=5)
+                except Exception as e:
+                    print(f"[TASK_MANAGER] Loop cleanup failed: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join(timeout=5)
+            self._loop = None
+            self._loop_thread = None
+
     def get_queue_size(self) -> int:
         """Return the number of pending tasks."""
-        return self.task_queue.qsize()
+        return sum(1 for task in list(self.tasks.values()) if task.status == TaskStatus.PENDING)
 
 
 # Global task manager instance
@@ -3,14 +3,22 @@ Temp file utilities. Handles creation and cleanup of temp files used during form
 """
 
 from pathlib import Path
-import uuid
+import os
 import time
+import secrets
+import threading
+
+_ensured_dirs = set()  # Temp dirs already created by get_temp_path
+_ensured_lock = threading.Lock()
 
 
 def get_temp_path(prefix: str, extension: str, temp_dir: Path) -> Path:
-    """Generate a unique temp file path using UUID. The file is not created."""
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    return temp_dir / f"{prefix}_{uuid.uuid4().hex[:8]}{extension}"
+    """Generate a unique temp file path (8 random hex chars). The file is not created."""
+    if temp_dir not in _ensured_dirs:
+        with _ensured_lock:
+            temp_dir.mkdir(parents=True, exist_ok=True)
+            _ensured_dirs.add(temp_dir)
+    return temp_dir / f"{prefix}_{secrets.token_hex(4)}{extension}"
 
 
 def cleanup_temp_directory(temp_dir: Path, max_age_hours: int = 1):
@@ -20,21 +28,22 @@ def cleanup_temp_directory(temp_dir: Path, max_age_hours: int = 1):
 
     now = time.time()
     max_age_seconds = max_age_hours * 3600
-    cleaned_count = 0
-
-    for file in temp_dir.iterdir():
-        if file.is_file():
-            age = now - file.stat().st_mtime
-            if age > max_age_seconds:
+    deleted = []
+
+    # scandir entries carry the file type from the directory read: one stat per file at most
+    with os.scandir(temp_dir) as it:
+        for entry in it:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if now - entry.stat(follow_symlinks=False).st_mtime > max_age_seconds:
                 try:
-                    file.unlink()
-                    cleaned_count += 1
-                    print(f"[CLEANUP] Deleted temp file: {file.name}")
-                except Exception as e:
-                    print(f"[CLEANUP] Failed to delete {file.name}: {e}")
-
-    if cleaned_count > 0:
-        print(f"[CLEANUP] {cleaned_count} temp file(s) deleted")
+                    os.unlink(entry.path)
+                    deleted.append(entry.name)
+                except OSError as e:
+                    print(f"[CLEANUP] Failed to delete {entry.name}: {e}")
+
+    if deleted:
+        print(f"[CLEANUP] {len(deleted)} temp file(s) deleted: {', '.join(deleted)}")
 
 
 def safe_delete(file_path: Path):
@@ -12,10 +12,13 @@ import base64
 import time
 import logging
 import requests
+import urllib3
 import trimesh
 from pathlib import Path
 from PIL import Image
 
+from .http_retry import RETRY_STATUSES, MAX_ATTEMPTS, retry_delay
+
 logger = logging.getLogger(__name__)
 
 MAX_IMAGE_SIZE = 2048  # TRELLIS.2 benefits from larger input images
@@ -32,6 +35,44 @@ def _encode_image_b64(image_path: Path, max_size: int = MAX_IMAGE_SIZE) -> str:
     return base64.b64encode(buf.getvalue()).decode()
 
 
+def _not_sent(error: requests.RequestException) -> bool:
+    """
+    True when the request never reached the server: connect timeout, or a connection that
+    could not be opened (urllib3 NewConnectionError, e.g. DNS or refused). Other ConnectionErrors
+    ("Connection aborted", RemoteDisconnected) can happen after the body was sent.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError):
+        return False
+
+    # requests wraps urllib3's MaxRetryError, whose .reason holds the underlying error
+    cause = error.args[0] if error.args else None
+    cause = getattr(cause, "reason", cause)
+    return isinstance(cause, urllib3.exceptions.NewConnectionError)
+
+
+def _submit_with_retry(url: str, payload: dict, headers: dict) -> requests.Response:
+    """POST a RunPod job, retrying rate limits and connection failures (never a job that may have been queued)."""
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        try:
+            resp = requests.post(url, json=payload, headers=headers, timeout=60)
+        except requests.ConnectionError as e:  # ConnectTimeout is a subclass
+            if last_attempt or not _not_sent(e):
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"[TRELLIS2] Submit connection failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if resp.status_code not in RETRY_STATUSES or last_attempt:
+            return resp
+        delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+        logger.warning(f"[TRELLIS2] Submit HTTP {resp.status_code}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
 def generate_mesh_from_image_trellis2(
     image_path: Path,
     output_path: Path,
@@ -76,7 +117,7 @@ def generate_mesh_from_image_trellis2(
 
     t0 = time.time()
     logger.info(f"[TRELLIS2] Submitting job to {submit_url}...")
-    resp = requests.post(submit_url, json=payload, headers=headers, timeout=60)
+    resp = _submit_with_retry(submit_url, payload, headers)
     resp.raise_for_status()
     job_id = resp.json()["id"]
     logger.info(f"[TRELLIS2] Job submitted: {job_id} (took {time.time()-t0:.1f}s)")
@@ -119,11 +160,13 @@ def generate_mesh_from_image_trellis2(
                     import shutil
                     shutil.copy2(local_path, output_path)
             else:
-                # Fallback: download from URL
-                r = requests.get(glb_url, timeout=60)
-                r.raise_for_status()
+                # Fallback: download from URL, streamed to disk in 64 KB chunks
                 output_path.parent.mkdir(parents=True, exist_ok=True)
-                output_path.write_bytes(r.content)
+                with requests.get(glb_url, timeout=60, stream=True) as r:
+                    r.raise_for_status()
+                    with open(output_path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=1 << 16):
+                            f.write(chunk)
 
             # Get mesh stats
             mesh = trimesh.load(str(output_path), force="mesh")
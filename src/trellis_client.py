@@ -7,39 +7,185 @@ import os
 import io
 import base64
 import time
+import asyncio
 import logging
-import requests
+import weakref
+import functools
+import httpx
 import trimesh
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from PIL import Image
 
+from . import mesh_cache
+from .converter import glb_counts
+from .http_retry import RETRY_STATUSES, MAX_ATTEMPTS, retry_delay
+
 logger = logging.getLogger(__name__)
 
 MAX_IMAGE_SIZE = 1024  # TRELLIS internally reduces to 518px; 1024 is sufficient
+RUNPOD_API_BASE = "https://api.runpod.ai/v2"
+
+# Status polling: start fast, back off x1.5 up to POLL_MAX_DELAY; queued jobs are polled slowly
+POLL_MIN_DELAY = 1.0
+POLL_MAX_DELAY = 10.0
+POLL_QUEUED_DELAY = 5.0
+
+
+KEEPALIVE_EXPIRY = 60.0
+
+_client: Optional[httpx.AsyncClient] = None
+# Client -> time.monotonic() of its last response, to tell whether a pooled connection is still alive
+_last_response: "weakref.WeakKeyDictionary[httpx.AsyncClient, float]" = weakref.WeakKeyDictionary()
+
+
+def _new_client() -> httpx.AsyncClient:
+    """HTTP/2 client for RunPod requests."""
+    client = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=32, keepalive_expiry=KEEPALIVE_EXPIRY)
+    )
+
+    async def _stamp(response: httpx.Response):
+        _last_response[client] = time.monotonic()
+
+    client.event_hooks["response"] = [_stamp]
+    return client
+
+
+def _has_idle_connection(client: httpx.AsyncClient) -> bool:
+    """True if the client got a response recently enough that its keep-alive connection is still pooled."""
+    last = _last_response.get(client)
+    return last is not None and time.monotonic() - last < KEEPALIVE_EXPIRY
+
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    Shared HTTP/2 client, so consecutive jobs reuse the RunPod connection.
+
+    Created on first use and bound to the loop that supervises TRELLIS jobs (TaskManager's);
+    only touched from that loop, so no lock is needed. Closed by aclose_client().
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    return _client
+
+
+async def aclose_client():
+    """Close the shared client. Must run on the loop that created it."""
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+@functools.lru_cache(maxsize=1)
+def _endpoint() -> tuple:
+    """
+    Returns (endpoint_id, headers, submit_url, status_url_prefix, health_url), read from the environment on first use.
+
+    endpoint_id / headers are None when RUNPOD_TRELLIS_ENDPOINT_ID or RUNPOD_API_KEY is missing.
+    """
+    endpoint_id = os.getenv("RUNPOD_TRELLIS_ENDPOINT_ID")
+    api_key = os.getenv("RUNPOD_API_KEY")
+    if not endpoint_id or not api_key:
+        return None, None, None, None, None
+    base = f"{RUNPOD_API_BASE}/{endpoint_id}"
+    return endpoint_id, {"Authorization": f"Bearer {api_key}"}, f"{base}/run", f"{base}/status/", f"{base}/health"
 
 
 def _encode_image_b64(image_path: Path, max_size: int = MAX_IMAGE_SIZE) -> str:
-    """Encode an image as base64, resizing it if larger than max_size px."""
-    img = Image.open(image_path)
-    if max(img.size) > max_size:
-        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-        logger.info(f"[TRELLIS] Resized {image_path.name}: {img.size}")
+    """
+    Encode an image as base64, resizing it if larger than max_size px.
+
+    Images already within max_size are sent as their original file bytes (no decode/re-encode).
+    Resized images are re-encoded as JPEG, or PNG when they carry alpha (TRELLIS uses it as mask).
+    """
+    img = Image.open(image_path)  # lazy: reads the header only
+    if max(img.size) <= max_size and img.format in ("PNG", "JPEG"):
+        return base64.b64encode(image_path.read_bytes()).decode()
+
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    logger.info(f"[TRELLIS] Resized {image_path.name}: {img.size}")
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode()
+    if img.mode in ("RGBA", "LA", "P"):
+        img.save(buf, format="PNG")
+    else:
+        img.convert("RGB").save(buf, format="JPEG", quality=92)
+    return base64.b64encode(buf.getbuffer()).decode()
 
 
-def generate_mesh_from_image_trellis(
+def _mesh_counts(glb_path: Path) -> tuple:
+    """Returns (vertices_count, faces_count) of a GLB, from its JSON header when possible."""
+    counts = glb_counts(glb_path)
+    if counts is None:
+        mesh = trimesh.load(str(glb_path), force="mesh")
+        counts = (len(mesh.vertices), len(mesh.faces))
+    return counts
+
+
+def _save_glb_stats(glb_b64: str, output_path: Path, key: str) -> tuple:
+    """Decode, save and cache the returned GLB. Returns (vertices_count, faces_count)."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Decode in slices (a multiple of 4 chars) so the full GLB is never held as bytes too
+    step = 4 << 20
+    with open(output_path, "wb") as f:
+        for start in range(0, len(glb_b64), step):
+            f.write(base64.b64decode(glb_b64[start:start + step]))
+    mesh_cache.store(key, output_path)
+
+    return _mesh_counts(output_path)
+
+
+async def _prewarm(client: httpx.AsyncClient, url: str, headers: dict):
+    """Cheap request that establishes the connection ahead of the submit. Failures are ignored."""
+    try:
+        await client.get(url, headers=headers, timeout=10)
+    except Exception:
+        pass  # the submit will open its own connection
+
+
+async def _submit_with_retry(client: httpx.AsyncClient, url: str, payload: dict, headers: dict) -> httpx.Response:
+    """POST a RunPod job, retrying rate limits and connection failures (never a job that may have been queued)."""
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        try:
+            resp = await client.post(url, json=payload, headers=headers, timeout=60)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            if last_attempt:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"[TRELLIS] Submit connection failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        if resp.status_code not in RETRY_STATUSES or last_attempt:
+            return resp
+        delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+        logger.warning(f"[TRELLIS] Submit HTTP {resp.status_code}, retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+async def generate_mesh_from_image_trellis_async(
     image_path: Path,
     output_path: Path,
     resolution: str = "medium",
     extra_images: List[Path] = None,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> dict:
-    endpoint_id = os.getenv("RUNPOD_TRELLIS_ENDPOINT_ID")
-    api_key = os.getenv("RUNPOD_API_KEY")
+    """
+    Submit a TRELLIS job and poll it without blocking a thread.
 
-    if not endpoint_id or not api_key:
+    The submit and every status poll go through the shared HTTP/2 client (or client, when
+    called from another event loop); waits use asyncio.sleep, so many jobs can be
+    supervised from a single event loop.
+    """
+    endpoint_id, headers, submit_url, status_url_prefix, health_url = _endpoint()
+
+    if endpoint_id is None:
+        _endpoint.cache_clear()  # .env may be fixed without a restart
         return {
             "success": False,
             "error": "RUNPOD_TRELLIS_ENDPOINT_ID or RUNPOD_API_KEY missing in .env",
@@ -61,20 +207,43 @@ def generate_mesh_from_image_trellis(
 
     logger.info(f"[TRELLIS] Provider called: {len(all_images)} image(s), resolution={resolution}, endpoint={endpoint_id}")
 
-    # Build payload (single or multi)
-    headers = {"Authorization": f"Bearer {api_key}"}
-    submit_url = f"https://api.runpod.ai/v2/{endpoint_id}/run"
+    # Hashing the images and copying the cached GLB are blocking file I/O: keep them off the loop
+    key = await asyncio.to_thread(mesh_cache.cache_key, all_images, {"provider": "trellis", **params})
+    if await asyncio.to_thread(mesh_cache.fetch, key, output_path):
+        logger.info("[TRELLIS] Same image(s) and parameters already generated, reusing GLB")
+        vertices_count, faces_count = await asyncio.to_thread(_mesh_counts, output_path)
+        return {
+            "success": True,
+            "output_file": str(output_path),
+            "output_filename": output_path.name,
+            "vertices_count": vertices_count,
+            "faces_count": faces_count,
+            "resolution": resolution,
+            "generation_time_ms": 0,
+            "method": "trellis_runpod",
+            "api_credits_used": 0,
+            "cached": True,
+        }
+
+    client = client or _get_client()
+
+    # No pooled connection alive (first job, idle expiry): open one while the images are encoded
+    warmup = None
+    if not _has_idle_connection(client):
+        warmup = asyncio.create_task(_prewarm(client, health_url, headers))
 
+    # Build payload (single or multi)
     if len(all_images) > 1:
-        images_b64 = [_encode_image_b64(p) for p in all_images]
+        # PIL releases the GIL while decoding/resizing: encode all views concurrently
+        images_b64 = await asyncio.gather(*(asyncio.to_thread(_encode_image_b64, p) for p in all_images))
         logger.info(f"[TRELLIS] Multi-image: {len(images_b64)} images encoded")
         input_data = {
-            "images_base64": images_b64,
+            "images_base64": list(images_b64),
             "texture_size": params["texture_size"],
             "simplify": params["simplify"],
         }
     else:
-        image_b64 = _encode_image_b64(all_images[0])
+        image_b64 = await asyncio.to_thread(_encode_image_b64, all_images[0])
         logger.info(f"[TRELLIS] Single image encoded: {len(image_b64)} chars")
         input_data = {
             "image_base64": image_b64,
@@ -87,24 +256,33 @@ def generate_mesh_from_image_trellis(
         "policy": {"executionTimeout": 600000},  # 10 min
     }
 
+    if warmup is not None:
+        warmup.cancel()  # never hold the submit back; a connection it already opened stays pooled
+
     t0 = time.time()
     logger.info(f"[TRELLIS] Submitting job to {submit_url}...")
-    resp = requests.post(submit_url, json=payload, headers=headers, timeout=60)
+    resp = await _submit_with_retry(client, submit_url, payload, headers)
     resp.raise_for_status()
     job_id = resp.json()["id"]
     logger.info(f"[TRELLIS] Job submitted: {job_id} (took {time.time()-t0:.1f}s)")
 
     # Poll for result
-    status_url = f"https://api.runpod.ai/v2/{endpoint_id}/status/{job_id}"
+    status_url = status_url_prefix + job_id
     timeout_s = 600  # 10 min
+    delay = POLL_MIN_DELAY
 
     while time.time() - t0 < timeout_s:
-        time.sleep(5)
-        resp = requests.get(status_url, headers=headers, timeout=30)
+        await asyncio.sleep(delay)
+        resp = await client.get(status_url, headers=headers, timeout=30)
         data = resp.json()
         status = data.get("status")
         logger.info(f"[TRELLIS] Job {job_id}: {status}")
 
+        if status == "IN_QUEUE":
+            delay = POLL_QUEUED_DELAY  # waiting for a worker, nothing will happen soon
+        else:
+            delay = min(delay * 1.5, POLL_MAX_DELAY)
+
         if status == "COMPLETED":
             output = data["output"]
             if not output.get("success"):
@@ -113,20 +291,17 @@ def generate_mesh_from_image_trellis(
                     "error": output.get("error", "Unknown error"),
                 }
 
-            # Decode and save GLB
-            glb_bytes = base64.b64decode(output["glb_base64"])
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            output_path.write_bytes(glb_bytes)
-
-            # Get mesh stats
-            mesh = trimesh.load(str(output_path), force="mesh")
+            # Decoding and loading the GLB is blocking work: keep it off the event loop
+            vertices_count, faces_count = await asyncio.to_thread(
+                _save_glb_stats, output["glb_base64"], output_path, key
+            )
 
             return {
                 "success": True,
                 "output_file": str(output_path),
                 "output_filename": output_path.name,
-                "vertices_count": len(mesh.vertices),
-                "faces_count": len(mesh.faces),
+                "vertices_count": vertices_count,
+                "faces_count": faces_count,
                 "resolution": resolution,
                 "generation_time_ms": round((time.time() - t0) * 1000),
                 "method": "trellis_runpod",
@@ -140,3 +315,23 @@ def generate_mesh_from_image_trellis(
             return {"success": False, "error": f"RunPod FAILED: {error}"}
 
     return {"success": False, "error": f"Timeout after {timeout_s}s"}
+
+
+def generate_mesh_from_image_trellis(
+    image_path: Path,
+    output_path: Path,
+    resolution: str = "medium",
+    extra_images: List[Path] = None,
+) -> dict:
+    """Blocking wrapper around generate_mesh_from_image_trellis_async (own loop, so its own client)."""
+    async def run():
+        async with _new_client() as client:
+            return await generate_mesh_from_image_trellis_async(
+                image_path=image_path,
+                output_path=output_path,
+                resolution=resolution,
+                extra_images=extra_images,
+                client=client,
+            )
+
+    return asyncio.run(run())
@@ -3,9 +3,13 @@ Local TripoSR client for 3D mesh generation.
 Open-source model co-developed by Tripo AI and Stability AI. Generates meshes from a single image in < 0.5s on GPU.
 """
 
+import os
 import sys
 import time
-import trimesh
+import threading
+import contextlib
+import queue
+from concurrent.futures import Future
 from pathlib import Path
 from typing import Dict
 
@@ -14,10 +18,90 @@ TRIPOSR_PATH = Path(__file__).parent.parent / "tools" / "TripoSR"
 if str(TRIPOSR_PATH) not in sys.path:
     sys.path.insert(0, str(TRIPOSR_PATH))
 
+# Resolution to marching cubes resolution mapping
+MC_RESOLUTION = {
+    'low': 128,
+    'medium': 256,
+    'high': 512
+}
+
+# Opt-in: compile the decoder MLP with TorchInductor (needs Triton; first generation takes minutes)
+COMPILE_DECODER = os.getenv("TRIPOSR_COMPILE") == "1"
+
 # Global model cache to avoid reloading on every call
 _model_cache = None
 _model_device = None
 
+# Single thread owning all TripoSR GPU work (model load, forward, extraction): concurrent
+# generations queue here instead of sharing the model and CUDA allocator across threads.
+# A daemon thread, so a running generation never blocks interpreter exit.
+_gpu_queue: queue.Queue = queue.Queue()
+_gpu_thread = None
+_gpu_lock = threading.Lock()
+
+
+def _gpu_worker():
+    """Run queued (future, fn, args) jobs one at a time, forever."""
+    while True:
+        future, fn, args = _gpu_queue.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+
+def _submit_gpu(fn, *args) -> Future:
+    """Queue fn(*args) on the TripoSR GPU thread, starting it on first use."""
+    global _gpu_thread
+    with _gpu_lock:
+        if _gpu_thread is None:
+            _gpu_thread = threading.Thread(target=_gpu_worker, name="triposr-gpu", daemon=True)
+            _gpu_thread.start()
+    future = Future()
+    _gpu_queue.put((future, fn, args))
+    return future
+
+_rembg_session = None
+_rembg_lock = threading.Lock()
+
+
+def _get_rembg_session():
+    """Background removal session (U^2-Net, ~170MB), created once. Uses CUDA when onnxruntime-gpu is installed."""
+    global _rembg_session
+    with _rembg_lock:
+        if _rembg_session is None:
+            import rembg
+            print("  [TRIPOSR] Loading background removal model (first time, will be cached)...")
+            _rembg_session = rembg.new_session("u2net")
+        return _rembg_session
+
+
+def _use_bf16(device: str) -> bool:
+    """bf16 inference on GPUs with native support (Ampere and newer)."""
+    import torch
+    # is_bf16_supported() also reports emulated bf16 (T4, V100), which is slower than fp32
+    return device.startswith("cuda") and torch.cuda.get_device_capability(device)[0] >= 8
+
+
+def _bf16_forward(forward):
+    """
+    Wrap a module forward to run under bf16 autocast and return float32 tensors.
+
+    Marching cubes and the trimesh export (via numpy) need float32, so outputs are cast back.
+    """
+    import torch
+
+    def wrapped(*args, **kwargs):
+        with torch.autocast("cuda", dtype=torch.bfloat16):
+            out = forward(*args, **kwargs)
+        if isinstance(out, dict):
+            return {k: v.float() if torch.is_tensor(v) else v for k, v in out.items()}
+        return out.float()
+
+    return wrapped
+
 
 def _get_model(device: str):
     """Load the TripoSR model, cached after the first call."""
@@ -26,8 +110,18 @@ def _get_model(device: str):
     if _model_cache is not None and _model_device == device:
         return _model_cache
 
+    import torch
     from tsr.system import TSR
 
+    if device == "cpu":
+        # CPU fallback: leave half the cores to the API server, its other workers and rembg
+        # instead of letting OpenMP spread over all of them
+        torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # only settable before the first parallel op in this process
+
     print(f"  [TRIPOSR] Loading model (first time, will be cached)...")
     model = TSR.from_pretrained(
         "stabilityai/TripoSR",
@@ -35,7 +129,15 @@ def _get_model(device: str):
         weight_name="model.ckpt"
     )
     model.to(device)
-    model.renderer.set_chunk_size(8192)
+    if COMPILE_DECODER and device.startswith("cuda"):
+        print("  [TRIPOSR] Compiling decoder (max-autotune)...")
+        model.decoder.forward = torch.compile(model.decoder.forward, mode="max-autotune", dynamic=False)
+    if _use_bf16(device):
+        # Density/color queries of extract_mesh go through the decoder MLP
+        model.decoder.forward = _bf16_forward(model.decoder.forward)
+        model.renderer.set_chunk_size(16384)  # bf16 halves activation memory
+    else:
+        model.renderer.set_chunk_size(8192)
 
     _model_cache = model
     _model_device = device
@@ -43,6 +145,66 @@ def _get_model(device: str):
     return model
 
 
+def _run_inference(image, device: str, mc_res: int):
+    """
+    Model forward + mesh extraction for one preprocessed RGBA image. Returns a trimesh.Trimesh.
+
+    Only ever called on the TripoSR GPU thread (_submit_gpu). Everything stays on the default CUDA stream:
+    TSR's marching cubes extension launches there, and serializing on one thread already
+    rules out overlap between requests.
+    """
+    import torch
+    import numpy as np
+
+    # Load model (cached)
+    model = _get_model(device)
+
+    # 50% grey background via alpha compositing (matches official pipeline), done in place on
+    # the model's device. TSR's image processor takes float HWC tensors in [0, 1] directly,
+    # so there is no round trip through uint8 / PIL.
+    rgba = torch.from_numpy(np.array(image))  # uint8: 4x less to upload than float32
+    if device.startswith("cuda"):
+        # Pinned (page-locked) staging, recycled by PyTorch's host caching allocator,
+        # lets the upload run asynchronously, ordered before the ops that read it
+        rgba = rgba.pin_memory().to(device, non_blocking=True)
+    rgba = rgba.float().div_(255.0)
+    alpha = rgba[:, :, 3:4]
+    image = rgba[:, :, :3].mul_(alpha).add_(alpha.neg().add_(1.0).mul_(0.5))
+
+    # Generate 3D representation
+    print(f"  Generating 3D representation...")
+    bf16 = _use_bf16(device)
+    autocast = torch.autocast("cuda", dtype=torch.bfloat16) if bf16 else contextlib.nullcontext()
+    with torch.no_grad(), autocast:
+        scene_codes = model([image], device=device)
+    if bf16:
+        scene_codes = scene_codes.float()
+
+    # Extract mesh
+    print(f"  Extracting mesh (resolution={mc_res})...")
+    meshes = model.extract_mesh(
+        scene_codes,
+        has_vertex_color=True,
+        resolution=mc_res,
+        threshold=25.0
+    )
+
+    return meshes[0]
+
+
+def _cleanup_mesh(mesh):
+    """Keep the largest connected component (drops floaters), remove degenerate/duplicate faces, fix normals."""
+    components = mesh.split()
+    if len(components) > 1:
+        mesh = max(components, key=lambda m: len(m.faces))
+        print(f"  Removed {len(components)-1} floater(s)")
+
+    mesh.update_faces(mesh.nondegenerate_faces())
+    mesh.update_faces(mesh.unique_faces())
+    mesh.fix_normals()
+    return mesh
+
+
 def generate_mesh_from_image_triposr(
     image_path: Path,
     output_path: Path,
@@ -55,13 +217,6 @@ def generate_mesh_from_image_triposr(
     resolution controls marching cubes resolution: low=128, medium=256, high=512.
     """
     start_time = time.time()
-
-    # Resolution to marching cubes resolution mapping
-    MC_RESOLUTION = {
-        'low': 128,
-        'medium': 256,
-        'high': 512
-    }
     mc_res = MC_RESOLUTION.get(resolution, 256)
 
     try:
@@ -69,7 +224,6 @@ def generate_mesh_from_image_triposr(
         from tsr.utils import remove_background, resize_foreground
         from PIL import Image
         import torch
-        import numpy as np
 
         print(f"\n[TRIPOSR] Generating mesh from image")
         print(f"  Input: {image_path.name}")
@@ -82,32 +236,22 @@ def generate_mesh_from_image_triposr(
         if device == "cpu":
             print("  [WARN] Running on CPU - this will be slow!")
 
-        # Load model (cached)
-        model = _get_model(device)
-
         # Image preprocessing (matches the official run.py pipeline)
         print(f"  Preprocessing image...")
-        image = remove_background(Image.open(image_path), force=True)
+        image = remove_background(Image.open(image_path), rembg_session=_get_rembg_session(), force=True)
         image = resize_foreground(image, foreground_ratio)
-        # 50% grey background via alpha compositing (matches official pipeline)
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-
-        # Generate 3D representation
-        print(f"  Generating 3D representation...")
-        with torch.no_grad():
-            scene_codes = model([image], device=device)
-
-        # Extract mesh
-        print(f"  Extracting mesh (resolution={mc_res})...")
-        meshes = model.extract_mesh(
-            scene_codes,
-            has_vertex_color=True,
-            resolution=mc_res,
-            threshold=25.0
-        )
-        mesh = meshes[0]
+
+        # All GPU work goes through the single inference thread
+        mesh = _submit_gpu(_run_inference, image, device, mc_res).result()
+
+        # Cleaned in memory so the GLB is written only once
+        before = len(mesh.faces)
+        try:
+            mesh = _cleanup_mesh(mesh)
+            if len(mesh.faces) != before:
+                print(f"  Cleanup: {before} -> {len(mesh.faces)} faces")
+        except Exception as e:
+            print(f"  [WARN] Cleanup skipped: {e}")
 
         # GLB-First: force .glb extension
         if output_path.suffix.lower() != '.glb':
@@ -116,15 +260,9 @@ def generate_mesh_from_image_triposr(
         print(f"  Exporting to GLB: {output_path.name}")
         mesh.export(str(output_path), file_type='glb')
 
-        # Reload for stats
-        final_mesh = trimesh.load(str(output_path))
-        if hasattr(final_mesh, 'geometry'):
-            meshes_list = list(final_mesh.geometry.values())
-            if len(meshes_list) > 0:
-                final_mesh = meshes_list[0] if len(meshes_list) == 1 else trimesh.util.concatenate(meshes_list)
-
-        vertices_count = len(final_mesh.vertices)
-        faces_count = len(final_mesh.faces)
+        # Stats from the in-memory mesh: the GLB holds exactly this geometry
+        vertices_count = len(mesh.vertices)
+        faces_count = len(mesh.faces)
         generation_time = (time.time() - start_time) * 1000
 
         print(f"  [OK] Mesh generated successfully")